@@ -1,13 +1,29 @@
 import argparse
+import errno
+import functools
+import mmap
 import os
+import queue
 import subprocess
-import re
 import sys
+import threading
 import time
-import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
 from tabulate import tabulate
 from termcolor import colored
 
+DEST_OFFSET = 4 * 1024 * 1024  # 4MB offset on the destination
+MAX_POOL_SIZE = 256 * 1024 * 1024
+WARMUP_SIZE = 16 * 1024 * 1024
+FADVISE_INTERVAL = 64 * 1024 * 1024
+READ_SWEEP_STREAMS = 2
+VALIDATION_CANDIDATES = 3
+DEVICE_CLASS_BLOCK_SIZES = {
+    "nvme": [65536, 131072, 262144, 524288, 1048576, 4194304],
+    "ssd": [32768, 65536, 131072, 262144],
+    "hdd": [1048576, 4194304, 16777216],
+}
+
 def usage():
     """Prints the usage information for the script and exits."""
     ascii_art = """
@@ -29,6 +45,9 @@ MMMMMMMMMMM                                   MMMMMMMMMMM MMMMMMMMMMM
         ["--destination <DEST_DRIVE>", "Specify the destination drive (default: /dev/sdb)"],
         ["--block-size <BLOCK_SIZE>", "Specify the block size for dd command (default: 32768)"],
         ["--benchmark-size <SIZE>", "Specify the size of the benchmark in MB (default: 1024 MB)"],
+        ["--queue-depth <DEPTH>", "Specify the number of outstanding I/O requests during the benchmark (default: 32)"],
+        ["--copy-method <METHOD>", "Specify how --execute-with-autobench copies the data: sendfile or mmap (default: sendfile)"],
+        ["--streams <N>", "Specify the number of parallel dd streams in the service script when the source is NVMe (default: 4)"],
         ["--execute-with-autobench", "Run benchmark and start the dd command with the best block size"],
         ["--benchmark", "Benchmark to determine the best block size"],
         ["--enable-service", "Enable the systemd service"],
@@ -36,8 +55,12 @@ MMMMMMMMMMM                                   MMMMMMMMMMM MMMMMMMMMMM
     ]
 
     command_data = [
-        ["Benchmark Command Utilized"],
-        ["dd if=<SOURCE_DRIVE> of=<DEST_DRIVE> bs=<BLOCK_SIZE> seek=<SEEK_VALUE> count=<COUNT> status=progress"],
+        ["Benchmark I/O Utilized"],
+        ["In-process O_DIRECT reads of <BLOCK_SIZE> from <SOURCE_DRIVE> into /dev/null, <QUEUE_DEPTH> requests in flight;"
+         " the 3 fastest sizes are re-run writing to <DEST_DRIVE> at byte offset 4MB"],
+        ["Service Command Utilized (one per stream)"],
+        ["dd if=<SOURCE_DRIVE> of=<DEST_DRIVE> bs=<BLOCK_SIZE> skip=<SKIP> seek=<SEEK> count=<CHUNK> "
+         "iflag=direct,fullblock oflag=direct conv=notrunc,fsync status=progress"],
     ]
 
     flags_data = [
@@ -45,8 +68,11 @@ MMMMMMMMMMM                                   MMMMMMMMMMM MMMMMMMMMMM
         ["if", "Input file (source drive)"],
         ["of", "Output file (destination drive)"],
         ["bs", "Block size for read/write operations"],
-        ["seek=<SEEK_VALUE>", "Start writing at byte offset 4MB"],
-        ["count=<COUNT>", "Limit the number of blocks to copy"],
+        ["skip=<SKIP>", "Start reading at this stream's first block"],
+        ["seek=<SEEK>", "Start writing 8192 blocks in, plus this stream's first block"],
+        ["count=<CHUNK>", "Number of blocks copied by each stream"],
+        ["iflag/oflag=direct", "Bypass the page cache on both drives"],
+        ["conv=notrunc,fsync", "Do not truncate the output and flush it before exiting"],
         ["status=progress", "Display the progress of the operation"]
     ]
 
@@ -72,6 +98,7 @@ MMMMMMMMMMM                                   MMMMMMMMMMM MMMMMMMMMMM
 
     sys.exit(1)
 
+@functools.lru_cache(maxsize=64)
 def format_block_size(bs):
     """Formats the block size into a human-readable string."""
     if bs >= 1024**3:
@@ -93,113 +120,464 @@ def partitionProbe(dest_drive):
 
 def flush_cache():
     """Flushes the OS buffer cache."""
+    # os.sync() is the same syscall sync(1) makes, without a process spawn per trial.
+    os.sync()
+
+def device_size(path):
+    """Returns the size of a drive in bytes."""
+    fd = os.open(path, os.O_RDONLY)
     try:
-        subprocess.run(["sync"], check=True)
-    except subprocess.CalledProcessError as e:
-        print(f"Error flushing cache: {e}")
+        return os.lseek(fd, 0, os.SEEK_END)
+    finally:
+        os.close(fd)
+
+def _open_direct(path, flags):
+    """Opens a path with O_DIRECT, falling back to buffered I/O where unsupported."""
+    try:
+        return os.open(path, flags | os.O_DIRECT)
+    except OSError as e:
+        if e.errno != errno.EINVAL:
+            raise
+        return os.open(path, flags)
+
+def allocate_buffer_pool(size):
+    """Allocates a page-aligned, pre-faulted buffer pool for O_DIRECT copies."""
+    # MAP_POPULATE faults every page in up front so no trial pays for it mid-copy.
+    return mmap.mmap(-1, size, flags=mmap.MAP_PRIVATE | mmap.MAP_ANONYMOUS | mmap.MAP_POPULATE)
+
+def _copy_stripe(src_fd, dst_fd, view, block_size, first, count, stride, seek_bytes, failed):
+    """Copies every stride-th block starting at first and returns the bytes copied.
+
+    Stops early once failed is set, and sets it itself on error so the other
+    stripes of the trial stop too.
+    """
+    copied = 0
+    try:
+        for index in range(first, count, stride):
+            if failed.is_set():
+                break
+            offset = index * block_size
+            read = os.preadv(src_fd, [view], offset)
+            if read == 0:
+                break
+            written = 0
+            while written < read:  # finish a short write before counting the block
+                # Release the slice even on error so the trial can close its buffers.
+                with view[written:read] as chunk:
+                    written += os.pwrite(dst_fd, chunk, offset + seek_bytes + written)
+            copied += read
+    except OSError:
+        failed.set()
+        raise
+    return copied
+
+def _warm_up(src_fd, buf, offset):
+    """Reads from the source so the drive has left any idle state before a trial."""
+    try:
+        os.preadv(src_fd, [buf], offset)
+    except OSError:
+        pass  # the trial itself reports real read errors
+
+def run_dd(source_drive, dest_drive, block_size, benchmark_size, queue_depth=32, pool=None, trial_index=0):
+    """Copies benchmark_size MB with O_DIRECT I/O and returns the duration and bytes copied.
 
-def run_dd(source_drive, dest_drive, block_size, benchmark_size):
-    """Runs the dd command and returns the duration and output file."""
+    Each trial_index writes to its own region of the destination, so trials
+    never land on blocks an earlier trial already wrote.
+    """
     count = (benchmark_size * 1024 * 1024) // block_size
-    seek_value = 4 * 1024 * 1024 // block_size  # 4MB offset in terms of blocks
-    results_dir = os.path.join(os.path.dirname(__file__), 'results')
-    os.makedirs(results_dir, exist_ok=True)
-    output_file = os.path.join(results_dir, f"dd_output_{block_size}.txt")
+    seek_bytes = DEST_OFFSET + trial_index * benchmark_size * 2 * 1024 * 1024
+    queue_depth = max(1, min(queue_depth, count))
+
+    flush_cache()
+
+    owns_pool = pool is None or len(pool) < block_size
+    if owns_pool:
+        pool = allocate_buffer_pool(queue_depth * block_size)
+    queue_depth = min(queue_depth, len(pool) // block_size)
+
+    src_fd = dst_fd = None
+    warmup_buf = allocate_buffer_pool(WARMUP_SIZE)
+    pool_view = memoryview(pool)
+    views = [pool_view[i * block_size:(i + 1) * block_size] for i in range(queue_depth)]
+    try:
+        src_fd = _open_direct(source_drive, os.O_RDONLY)
+        dst_fd = _open_direct(dest_drive, os.O_WRONLY)
+
+        # Finish the warm-up before timing so it never competes with this trial's I/O,
+        # and read just past the trial's range so neither the drive's cache nor a
+        # buffered fallback serves the trial's first blocks. In the parallel read
+        # sweep it can still overlap the other stream's timed trial.
+        _warm_up(src_fd, warmup_buf, count * block_size)
+        start_time = time.time()
+        failed = threading.Event()
+        with ThreadPoolExecutor(max_workers=queue_depth) as executor:
+            futures = [
+                executor.submit(_copy_stripe, src_fd, dst_fd, views[i], block_size,
+                                i, count, queue_depth, seek_bytes, failed)
+                for i in range(queue_depth)
+            ]
+            bytes_transferred = sum(future.result() for future in futures)
+        try:
+            os.fsync(dst_fd)
+        except OSError as e:
+            if e.errno != errno.EINVAL:  # character devices such as /dev/null
+                raise
+        end_time = time.time()
+    except OSError as e:
+        if e.errno == errno.ENOSPC:
+            print(f"Error: {e}. Reducing benchmark size might help.")
+        else:
+            print(f"Error copying {source_drive} to {dest_drive} with block size {block_size}: {e}")
+        return None, 0
+    finally:
+        warmup_buf.close()
+        for view in views:
+            view.release()
+        pool_view.release()
+        if owns_pool:
+            pool.close()
+        for fd in (src_fd, dst_fd):
+            if fd is not None:
+                os.close(fd)
+
+    return end_time - start_time, bytes_transferred
+
+def _run_dd_fallback(source_drive, dest_drive, block_size, copied, remaining):
+    """Copies the remaining bytes with dd, resuming at the given source offset."""
     command = [
         "dd",
         f"if={source_drive}",
         f"of={dest_drive}",
         f"bs={block_size}",
-        f"count={count}",
-        f"seek={seek_value}",
+        f"skip={copied}",
+        f"seek={DEST_OFFSET + copied}",
+        f"count={remaining}",
+        "iflag=skip_bytes,count_bytes",
+        "oflag=seek_bytes",
+        "conv=notrunc,fsync",
         "status=progress"
     ]
+    subprocess.run(command, check=True)
 
-    flush_cache()
+def run_sendfile(source_drive, dest_drive, block_size, count):
+    """Copies count blocks in-kernel with sendfile and returns the duration and bytes copied.
 
-    with open(output_file, "w", encoding="utf-8") as f:
-        start_time = time.time()
+    Falls back to dd when the kernel cannot sendfile between the two devices.
+    """
+    total = count * block_size
+    copied = 0
+    src_fd = dst_fd = None
+    start_time = time.time()
+    try:
+        src_fd = os.open(source_drive, os.O_RDONLY)
+        dst_fd = _open_direct(dest_drive, os.O_WRONLY)
+        os.posix_fadvise(src_fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        os.lseek(dst_fd, DEST_OFFSET, os.SEEK_SET)
+        released = 0
         try:
-            subprocess.run(command, stdout=f, stderr=subprocess.STDOUT, timeout=1800, check=True)
-        except subprocess.TimeoutExpired:
-            return None, output_file
-        except subprocess.CalledProcessError as e:
-            if "No space left on device" in str(e):
-                print(f"Error: {e}. Reducing benchmark size might help.")
-            return None, output_file
-        end_time = time.time()
-
-    return end_time - start_time, output_file
+            while copied < total:
+                sent = os.sendfile(dst_fd, src_fd, copied, min(block_size, total - copied))
+                if sent == 0:
+                    break
+                copied += sent
+                # Drop source pages already copied so a one-shot bulk copy does
+                # not evict everything else from the page cache.
+                if copied - released >= FADVISE_INTERVAL:
+                    os.posix_fadvise(src_fd, released, copied - released, os.POSIX_FADV_DONTNEED)
+                    released = copied
+            if copied > released:
+                os.posix_fadvise(src_fd, released, copied - released, os.POSIX_FADV_DONTNEED)
+        except OSError as e:
+            if e.errno != errno.EINVAL:
+                raise
+            print(colored(f"sendfile is not supported from {source_drive} to {dest_drive}, falling back to dd", 'yellow'))
+            os.close(dst_fd)
+            dst_fd = None
+            _run_dd_fallback(source_drive, dest_drive, block_size, copied, total - copied)
+            copied = total
+        if dst_fd is not None:
+            os.fsync(dst_fd)
+    except (OSError, subprocess.CalledProcessError) as e:
+        print(f"Error copying {source_drive} to {dest_drive}: {e}")
+        return None, copied
+    finally:
+        for fd in (src_fd, dst_fd):
+            if fd is not None:
+                os.close(fd)
+
+    return time.time() - start_time, copied
+
+def run_mmap_copy(source_drive, dest_drive, block_size, count):
+    """Copies count blocks straight out of a read-only mapping of the source.
+
+    Returns the duration and bytes copied.
+    """
+    copied = 0
+    src_fd = dst_fd = mm = None
+    start_time = time.time()
+    try:
+        src_fd = os.open(source_drive, os.O_RDONLY)
+        dst_fd = _open_direct(dest_drive, os.O_WRONLY)
+        # Block devices report st_size 0, so size the mapping from the end offset.
+        length = min(count * block_size, os.lseek(src_fd, 0, os.SEEK_END))
+        if length == 0:
+            return time.time() - start_time, 0
+        mm = mmap.mmap(src_fd, length, prot=mmap.PROT_READ)
+        mm.madvise(mmap.MADV_SEQUENTIAL)
+        os.lseek(dst_fd, DEST_OFFSET, os.SEEK_SET)
+        released = 0
+        with memoryview(mm) as view:
+            while copied < length:
+                end = min(copied + block_size, length)
+                while copied < end:  # finish a short write before moving to the next block
+                    copied += os.write(dst_fd, view[copied:end])
+                # Drop source pages already copied, from both this mapping and the
+                # page cache, so a one-shot bulk copy does not bloat the cache.
+                done = copied - copied % mmap.PAGESIZE
+                if done - released >= FADVISE_INTERVAL or (copied == length and done > released):
+                    mm.madvise(mmap.MADV_DONTNEED, released, done - released)
+                    os.posix_fadvise(src_fd, released, done - released, os.POSIX_FADV_DONTNEED)
+                    released = done
+        os.fsync(dst_fd)
+    except OSError as e:
+        print(f"Error copying {source_drive} to {dest_drive}: {e}")
+        return None, copied
+    finally:
+        if mm is not None:
+            mm.close()
+        for fd in (src_fd, dst_fd):
+            if fd is not None:
+                os.close(fd)
+
+    return time.time() - start_time, copied
+
+COPY_METHODS = {
+    "sendfile": run_sendfile,
+    "mmap": run_mmap_copy,
+}
+
+def _sysfs_queue_dir(path):
+    """Returns the sysfs queue directory of a block device (or its parent for a partition)."""
+    name = os.path.basename(os.path.realpath(path))
+    device_dir = os.path.realpath(os.path.join("/sys/class/block", name))
+    for candidate in (device_dir, os.path.dirname(device_dir)):
+        queue_dir = os.path.join(candidate, "queue")
+        if os.path.isdir(queue_dir):
+            return queue_dir
+    return None
+
+def _device_hints(path):
+    """Reads the kernel's block size hints for a device, converted to bytes."""
+    hints = {}
+    queue_dir = _sysfs_queue_dir(path)
+    if queue_dir is None:
+        return hints
+    for name in ("physical_block_size", "optimal_io_size", "max_sectors_kb", "max_hw_sectors_kb"):
+        try:
+            with open(os.path.join(queue_dir, name), "r", encoding="utf-8") as f:
+                value = int(f.read().strip())
+        except (OSError, ValueError):
+            continue
+        hints[name] = value * 1024 if name.endswith("_kb") else value
+    return hints
+
+def classify_device(path):
+    """Classifies a drive as 'nvme', 'ssd' or 'hdd' from sysfs, or None if it is not a block device."""
+    queue_dir = _sysfs_queue_dir(path)
+    if queue_dir is None:
+        return None
+    disk_dir = os.path.dirname(queue_dir)
+    # With native NVMe multipath the disk's device link points at the subsystem,
+    # which has no transport attribute, so the kernel name is the primary signal.
+    if os.path.basename(disk_dir).startswith("nvme"):
+        return "nvme"
+    if os.path.exists(os.path.join(disk_dir, "device", "transport")):
+        return "nvme"
+    try:
+        with open(os.path.join(queue_dir, "rotational"), "r", encoding="utf-8") as f:
+            rotational = f.read().strip() == "1"
+    except OSError:
+        return None
+    return "hdd" if rotational else "ssd"
+
+def _candidate_block_sizes(source_drive, dest_drive, block_sizes):
+    """Narrows block_sizes to the range the kernel reports as useful for both drives.
+
+    Sizes below the physical block size are always slow and sizes above
+    max_sectors_kb are split by the block layer anyway. When a drive reports an
+    optimal I/O size the sweep is centered on it instead; otherwise the sizes
+    known to suit the slower drive's class are used.
+    """
+    hints = [_device_hints(source_drive), _device_hints(dest_drive)]
+    physical = max(h.get("physical_block_size", 512) for h in hints)
+    # max_hw_sectors_kb is the hardware ceiling; use it when the soft limit is missing.
+    limits = [h.get("max_sectors_kb", h.get("max_hw_sectors_kb")) for h in hints]
+    largest = min((limit for limit in limits if limit), default=max(block_sizes))
+    optimal = max(h.get("optimal_io_size", 0) for h in hints)
+    classes = [classify_device(source_drive), classify_device(dest_drive)]
+    slowest = next((c for c in ("hdd", "ssd", "nvme") if c in classes), None)
+    if optimal:
+        block_sizes = [optimal // 4, optimal // 2, optimal, optimal * 2, optimal * 4]
+    elif slowest is not None:
+        block_sizes = DEVICE_CLASS_BLOCK_SIZES[slowest]
+
+    candidates = set()
+    for bs in block_sizes:
+        bs = min(max(bs, physical), max(largest, physical))
+        candidates.add(bs - bs % physical)
+    return sorted(candidates)
+
+def _result_row(bs, duration, bytes_transferred):
+    """Builds a results table row for a trial and returns it with the speed in MB/s."""
+    if not duration or not bytes_transferred:
+        return (format_block_size(bs), None, None, None), 0
+    mb_transferred = bytes_transferred / (1024 * 1024)
+    gb_transferred = bytes_transferred / (1024**3)
+    speed_value = mb_transferred / duration
+    row = (format_block_size(bs),
+           f"{mb_transferred:.2f} MB / {gb_transferred:.2f} GB",
+           duration, f"{speed_value:.2f} MB/s")
+    return row, speed_value
+
+def _print_results(results):
+    """Prints benchmark results as a table."""
+    lines = [f"{'Block Size':>10} {'Data Transferred':>24} {'Time (s)':>8} {'Speed':>14}"]
+    for bs_str, data, t, speed in results:
+        if t is None:
+            lines.append(f"{bs_str:>10} {'failed':>24} {'-':>8} {'-':>14}")
+        else:
+            lines.append(f"{bs_str:>10} {data:>24} {t:>8.3f} {speed:>14}")
+    print(colored("\n".join(lines), 'cyan'))
+
+def _read_sweep(source_drive, block_sizes, benchmark_size, queue_depth):
+    """Times reads from the source into /dev/null for every block size, a few streams at a time."""
+    largest = max(block_sizes)
+    pool_size = max(largest, min(queue_depth * largest, MAX_POOL_SIZE // READ_SWEEP_STREAMS))
+    pools = queue.Queue()
+    for _ in range(READ_SWEEP_STREAMS):
+        pools.put(allocate_buffer_pool(pool_size))
+
+    def trial(bs):
+        pool = pools.get()
+        try:
+            return run_dd(source_drive, os.devnull, bs, benchmark_size, queue_depth, pool)
+        finally:
+            pools.put(pool)
 
-def parse_speed(output_file):
-    """Parses the speed from the dd output file."""
-    with open(output_file, "r", encoding="utf-8") as f:
-        lines = f.readlines()
+    with ThreadPoolExecutor(max_workers=READ_SWEEP_STREAMS) as executor:
+        timings = list(executor.map(trial, block_sizes))
 
-    last_line = lines[-1].strip()
+    while not pools.empty():
+        pools.get().close()
+    return timings
 
-    match = re.search(r"(\d+) bytes .* copied, ([\d.]+) s, ([\d.]+ .B/s)", last_line)
-    if match:
-        bytes_transferred = int(match.group(1))
-        time_seconds = float(match.group(2))
-        speed = match.group(3)
-        return time_seconds, speed, bytes_transferred
-    raise ValueError
+def benchmark(source_drive, dest_drive, benchmark_size, queue_depth=32):
+    """Benchmarks different block sizes to determine the best one.
 
-def benchmark(source_drive, dest_drive, benchmark_size):
-    """Benchmarks different block sizes to determine the best one."""
+    Every size is first measured read-only against /dev/null; only the fastest
+    few are then validated with real writes to the destination.
+    """
     block_sizes = [
         512, 1024, 2048, 4096, 8192, 16384, 32768, 65536, 131072, 262144, 524288,
         1048576, 2097152, 4194304, 8388608, 16777216, 33554432, 67108864
     ]
-    results = []
+    block_sizes = _candidate_block_sizes(source_drive, dest_drive, block_sizes)
     best_speed = 0
     best_block_size = 32768
 
-    for bs in block_sizes:
-        duration, output_file = run_dd(source_drive, dest_drive, bs, benchmark_size)
-        if duration is None:
-            results.append((format_block_size(bs), None, None, None))
-            continue
-        try:
-            time_seconds, speed, bytes_transferred = parse_speed(output_file)
-            mb_transferred = bytes_transferred / (1024 * 1024)
-            gb_transferred = bytes_transferred / (1024**3)
-            speed_value, speed_unit = speed.split()
-            speed_value = float(speed_value)
-            if "GB" in speed_unit:
-                speed_value *= 1024  # Convert GB/s to MB/s
-            results.append(
-                (format_block_size(bs),
-                 f"{mb_transferred:.2f} MB / {gb_transferred:.2f} GB",
-                 time_seconds, speed)
-            )
-            if speed_value > best_speed:
-                best_speed = speed_value
-                best_block_size = bs
-        except (ValueError, IndexError):
-            results.append((format_block_size(bs), None, None, None))
-            continue
+    # Size the destination first so a bad path fails before the read sweep runs.
+    try:
+        dest_size = device_size(dest_drive)
+    except OSError as e:
+        print(colored(f"Error reading the size of {dest_drive}: {e}", 'red'))
+        return best_block_size
+    regions = max(1, (dest_size - DEST_OFFSET) // (benchmark_size * 2 * 1024 * 1024))
+
+    timings = _read_sweep(source_drive, block_sizes, benchmark_size, queue_depth)
+    sweep = [_result_row(bs, *timing) for bs, timing in zip(block_sizes, timings)]
+    print(colored(f"Read sweep ({source_drive} -> {os.devnull}):", 'yellow'))
+    _print_results([row for row, _ in sweep])
+
+    ranked = sorted(zip(block_sizes, sweep), key=lambda item: item[1][1], reverse=True)
+    candidates = [bs for bs, (_, speed) in ranked[:VALIDATION_CANDIDATES] if speed > 0]
+    if not candidates:
+        print(colored(f"No block size completed the read sweep, using {format_block_size(best_block_size)}", 'red'))
+        return best_block_size
 
-    df = pd.DataFrame(results, columns=["Block Size", "Data Transferred", "Time (seconds)", "Speed"])
-    table = tabulate(df, headers='keys', tablefmt='fancy_grid')
-    print(colored(table, 'cyan'))
+    results = []
+    # One pool serves every trial; capped so large block sizes run at a lower queue depth.
+    largest = max(candidates)
+    pool = allocate_buffer_pool(max(largest, min(queue_depth * largest, MAX_POOL_SIZE)))
+
+    for trial_index, bs in enumerate(candidates):
+        duration, bytes_transferred = run_dd(source_drive, dest_drive, bs, benchmark_size,
+                                             queue_depth, pool, trial_index % regions)
+        row, speed_value = _result_row(bs, duration, bytes_transferred)
+        results.append(row)
+        if speed_value > best_speed:
+            best_speed = speed_value
+            best_block_size = bs
+
+    pool.close()
+    print(colored(f"Write validation ({source_drive} -> {dest_drive}):", 'yellow'))
+    _print_results(results)
 
     print(colored(f"Best block size determined: {format_block_size(best_block_size)} with speed: {best_speed:.2f} MB/s", 'green'))
     return best_block_size
 
-def execute_with_autobench(source_drive, dest_drive):
-    """Executes the benchmark with default 1024 MB size and starts the dd command with the best block size."""
+def execute_with_autobench(source_drive, dest_drive, queue_depth=32, copy_method="sendfile"):
+    """Executes the benchmark with default 1024 MB size and starts the copy with the best block size."""
     print(colored("Running benchmark with default 1024 MB size...", 'yellow'))
-    best_block_size = benchmark(source_drive, dest_drive, 1024)
-    print(colored(f"Starting the dd command with the best block size: {best_block_size}", 'yellow'))
-    run_dd(source_drive, dest_drive, best_block_size, 1024)
-    print(colored("Copy operation completed.", 'green'))
+    best_block_size = benchmark(source_drive, dest_drive, 1024, queue_depth)
+    print(colored(f"Starting the {copy_method} copy with the best block size: {best_block_size}", 'yellow'))
+    duration, copied = COPY_METHODS[copy_method](source_drive, dest_drive, best_block_size,
+                                                 (1024 * 1024 * 1024) // best_block_size)
+    if duration is None:
+        print(colored(f"Copy operation failed after {format_block_size(copied)}.", 'red'))
+        return False
+    speed = copied / (1024 * 1024) / duration if duration else 0
+    print(colored(f"Copy operation completed: {format_block_size(copied)} at {speed:.2f} MB/s", 'green'))
+    return True
 
-def create_dd_script(source_drive, dest_drive, block_size):
-    """Creates the dd script to be run by the systemd service."""
+def create_dd_script(source_drive, dest_drive, block_size, streams=4):
+    """Creates the dd script to be run by the systemd service.
+
+    For an NVMe source the copy is split into up to streams regions (capped at
+    the CPU count), each copied by its own dd process so the drive's hardware
+    queues stay busy. Any other source gets a single stream, since parallel
+    streams at distant offsets would make a rotational disk seek constantly.
+    """
+    if classify_device(source_drive) != "nvme":
+        streams = 1
     script_content = f"""#!/bin/bash
-dd if={source_drive} of={dest_drive} bs={block_size} seek=8192 status=progress
+set -euo pipefail
+
+SOURCE={source_drive}
+DEST={dest_drive}
+BS={block_size}
+STREAMS={streams}
+
+N=$(nproc --all | awk -v max="$STREAMS" '{{print ($1>max)?max:$1}}')
+SIZE=$(blockdev --getsize64 "$SOURCE")
+if [ -z "$SIZE" ] || [ "$SIZE" -eq 0 ]; then
+    echo "Could not determine the size of $SOURCE" >&2
+    exit 1
+fi
+TOTAL_BLOCKS=$(( (SIZE + BS - 1) / BS ))
+CHUNK_BLOCKS=$(( (TOTAL_BLOCKS + N - 1) / N ))
+
+pids=()
+for ((i = 0; i < N; i++)); do
+    dd if="$SOURCE" of="$DEST" bs="$BS" skip=$((i * CHUNK_BLOCKS)) seek=$((8192 + i * CHUNK_BLOCKS)) \\
+        count="$CHUNK_BLOCKS" iflag=direct,fullblock oflag=direct conv=notrunc,fsync status=progress &
+    pids+=($!)
+done
+
+status=0
+for pid in "${{pids[@]}}"; do
+    wait "$pid" || status=1
+done
+exit $status
 """
     with open("/usr/local/bin/run_dd.sh", "w", encoding="utf-8") as f:
         f.write(script_content)
@@ -216,6 +594,11 @@ Type=simple
 ExecStart=/usr/local/bin/run_dd.sh
 Restart=on-failure
 User=root
+Nice=-20
+IOSchedulingClass=realtime
+IOSchedulingPriority=0
+CPUSchedulingPolicy=fifo
+CPUSchedulingPriority=50
 StandardOutput=journal
 StandardError=journal
 
@@ -235,6 +618,13 @@ def start_systemd_service():
     """Starts the systemd service."""
     subprocess.run(["systemctl", "start", "darthdd.service"], check=True)
 
+def positive_int(value):
+    """Parses an integer command-line argument that must be at least 1."""
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {value}")
+    return number
+
 class CustomArgumentParser(argparse.ArgumentParser):
     def print_help(self):
         usage()
@@ -250,6 +640,12 @@ def main():
                         help="Specify the block size for dd command (default: 32768)")
     parser.add_argument("--benchmark-size", type=int, default=1024,
                         help="Specify the size of the benchmark in MB (default: 1024 MB)")
+    parser.add_argument("--queue-depth", type=positive_int, default=32,
+                        help="Specify the number of outstanding I/O requests during the benchmark (default: 32)")
+    parser.add_argument("--copy-method", choices=sorted(COPY_METHODS), default="sendfile",
+                        help="Specify how --execute-with-autobench copies the data (default: sendfile)")
+    parser.add_argument("--streams", type=positive_int, default=4,
+                        help="Specify the number of parallel dd streams in the service script when the source is NVMe (default: 4)")
     parser.add_argument("--execute-with-autobench", action="store_true",
                         help="Run benchmark and start the dd command with the best block size")
     parser.add_argument("--benchmark", action="store_true",
@@ -261,14 +657,14 @@ def main():
     args = parser.parse_args()
 
     if args.execute_with_autobench:
-        execute_with_autobench(args.source, args.destination)
-        sys.exit(0)
+        completed = execute_with_autobench(args.source, args.destination, args.queue_depth, args.copy_method)
+        sys.exit(0 if completed else 1)
 
     if args.benchmark:
         print(colored("Benchmarking to determine the best block size...", 'yellow'))
-        args.block_size = benchmark(args.source, args.destination, args.benchmark_size)
+        args.block_size = benchmark(args.source, args.destination, args.benchmark_size, args.queue_depth)
 
-    create_dd_script(args.source, args.destination, args.block_size)
+    create_dd_script(args.source, args.destination, args.block_size, args.streams)
 
     create_systemd_service()
 
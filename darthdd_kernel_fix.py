@@ -1,13 +1,15 @@
 import argparse
+import errno
+import functools
 import os
 import subprocess
-import re
 import sys
 import time
-import pandas as pd
 from tabulate import tabulate
 from termcolor import colored
 
+MAX_BATCH_BYTES = 64 * 1024 * 1024
+
 def usage():
     """Prints the usage information for the script and exits."""
     ascii_art = """
@@ -36,8 +38,10 @@ MMMMMMMMMMM                                   MMMMMMMMMMM MMMMMMMMMMM
     ]
 
     command_data = [
-        ["Benchmark Command Utilized"],
-        ["dd if=<SOURCE_DRIVE> of=<DEST_DRIVE> bs=<BLOCK_SIZE> seek=<SEEK_VALUE> count=<COUNT> status=progress"],
+        ["Benchmark I/O Utilized"],
+        ["In-process reads of <BLOCK_SIZE> from <SOURCE_DRIVE>, written to <DEST_DRIVE> in batches with pwritev, then fsync"],
+        ["Service Command Utilized"],
+        ["dd if=<SOURCE_DRIVE> of=<DEST_DRIVE> bs=<BLOCK_SIZE> seek=8192 iflag=direct,fullblock oflag=direct status=progress conv=fsync"],
     ]
 
     flags_data = [
@@ -45,9 +49,10 @@ MMMMMMMMMMM                                   MMMMMMMMMMM MMMMMMMMMMM
         ["if", "Input file (source drive)"],
         ["of", "Output file (destination drive)"],
         ["bs", "Block size for read/write operations"],
-        ["seek=<SEEK_VALUE>", "Start writing at byte offset 4MB"],
-        ["count=<COUNT>", "Limit the number of blocks to copy"],
-        ["status=progress", "Display the progress of the operation"]
+        ["seek=8192", "Start writing 8192 blocks into the destination"],
+        ["iflag/oflag=direct", "Bypass the page cache on both drives"],
+        ["status=progress", "Display the progress of the operation"],
+        ["conv=fsync", "Flush the output before exiting"]
     ]
 
     example_commands = [
@@ -72,6 +77,7 @@ MMMMMMMMMMM                                   MMMMMMMMMMM MMMMMMMMMMM
 
     sys.exit(1)
 
+@functools.lru_cache(maxsize=64)
 def format_block_size(bs):
     """Formats the block size into a human-readable string."""
     if bs >= 1024**3:
@@ -84,13 +90,18 @@ def format_block_size(bs):
 
 def flush_cache():
     """Flushes the OS buffer cache."""
-    try:
-        subprocess.run(["sync"], check=True)
-    except subprocess.CalledProcessError as e:
-        print(f"Error flushing cache: {e}")
+    # os.sync() is the same syscall sync(1) makes, without a process spawn per trial.
+    os.sync()
 
 def clear_destination(dest_drive):
-    """Clears the destination device by writing zeros to it."""
+    """Clears the destination device, discarding it when possible and writing zeros otherwise."""
+    # A whole-device discard (TRIM/UNMAP) finishes almost instantly on SSDs.
+    try:
+        subprocess.run(["blkdiscard", "-f", dest_drive], check=True)
+        return
+    except (OSError, subprocess.CalledProcessError) as e:
+        print(f"Discard not available for {dest_drive} ({e}), writing zeros instead")
+
     clear_command = [
         "dd",
         "if=/dev/zero",
@@ -104,53 +115,77 @@ def clear_destination(dest_drive):
     except subprocess.CalledProcessError as e:
         print(f"Error clearing destination device {dest_drive}: {e}")
 
-def run_dd(source_drive, dest_drive, block_size, benchmark_size):
-    """Runs the dd command and returns the duration and output file."""
+def device_size(path):
+    """Returns the size of a drive in bytes."""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        return os.lseek(fd, 0, os.SEEK_END)
+    finally:
+        os.close(fd)
+
+def run_pwritev(src_fd, dst_fd, bs, count, batch=16, offset=0):
+    """Copies count blocks from src_fd's current position to dst_fd at offset.
+
+    Each iteration moves up to batch blocks with one readv and one pwritev
+    into a fixed set of buffers. A short read is treated as the end of the
+    source. Returns the bytes copied.
+    """
+    batch = max(1, min(batch, MAX_BATCH_BYTES // bs))
+    bufs = [memoryview(bytearray(bs)) for _ in range(batch)]
+    copied = 0
+    remaining = count
+    while remaining > 0:
+        chunk = bufs[:min(batch, remaining)]
+        read = os.readv(src_fd, chunk)
+        if read == 0:
+            break
+        full, partial = divmod(read, bs)
+        short = full < len(chunk)
+        if short:
+            chunk = chunk[:full] + ([chunk[full][:partial]] if partial else [])
+        written = os.pwritev(dst_fd, chunk, offset + copied)
+        while written < read:  # finish a short write one buffer at a time
+            index, skip = divmod(written, bs)
+            written += os.pwrite(dst_fd, chunk[index][skip:], offset + copied + written)
+        copied += read
+        if short:
+            break
+        remaining -= full
+    return copied
+
+def run_dd(source_drive, dest_drive, block_size, benchmark_size, trial_index=0):
+    """Copies benchmark_size MB in-process with batched pwritev and returns the duration and bytes copied.
+
+    Each trial_index writes to its own region of the destination, so trials
+    never land on blocks an earlier trial already wrote.
+    """
     count = (benchmark_size * 1024 * 1024) // block_size
-    results_dir = os.path.join(os.path.dirname(__file__), 'results')
-    os.makedirs(results_dir, exist_ok=True)
-    output_file = os.path.join(results_dir, f"dd_output_{block_size}.txt")
-    command = [
-        "dd",
-        f"if={source_drive}",
-        f"of={dest_drive}",
-        f"bs={block_size}",
-        f"count={count}",
-        "status=progress",
-        "conv=fsync"
-    ]
+    seek_bytes = trial_index * benchmark_size * 2 * 1024 * 1024
 
     flush_cache()
-    clear_destination(dest_drive)
 
-    with open(output_file, "w", encoding="utf-8") as f:
+    src_fd = dst_fd = None
+    try:
+        src_fd = os.open(source_drive, os.O_RDONLY)
+        dst_fd = os.open(dest_drive, os.O_WRONLY)
+        # Every trial reads the same range, so evict it or later trials just time the page cache.
+        os.posix_fadvise(src_fd, 0, 0, os.POSIX_FADV_DONTNEED)
         start_time = time.time()
-        try:
-            subprocess.run(command, stdout=f, stderr=subprocess.STDOUT, timeout=1800, check=True)
-        except subprocess.TimeoutExpired:
-            return None, output_file
-        except subprocess.CalledProcessError as e:
-            if "No space left on device" in str(e):
-                print(f"Error: {e}. Reducing benchmark size might help.")
-            return None, output_file
+        bytes_transferred = run_pwritev(src_fd, dst_fd, block_size, count, offset=seek_bytes)
+        os.fsync(dst_fd)
         end_time = time.time()
-
-    return end_time - start_time, output_file
-
-def parse_speed(output_file):
-    """Parses the speed from the dd output file."""
-    with open(output_file, "r", encoding="utf-8") as f:
-        lines = f.readlines()
-
-    last_line = lines[-1].strip()
-
-    match = re.search(r"(\d+) bytes .* copied, ([\d.]+) s, ([\d.]+ .B/s)", last_line)
-    if match:
-        bytes_transferred = int(match.group(1))
-        time_seconds = float(match.group(2))
-        speed = match.group(3)
-        return time_seconds, speed, bytes_transferred
-    raise ValueError
+    except OSError as e:
+        if e.errno == errno.ENOSPC:
+            print(f"Error: {e}. Reducing benchmark size might help.")
+        else:
+            print(f"Error copying {source_drive} to {dest_drive} with block size {block_size}: {e}")
+        return None, 0
+    finally:
+        for fd in (src_fd, dst_fd):
+            if fd is not None:
+                os.close(fd)
+
+    return end_time - start_time, bytes_transferred
 
 def benchmark(source_drive, dest_drive, benchmark_size):
     """Benchmarks different block sizes to determine the best one."""
@@ -162,33 +197,34 @@ def benchmark(source_drive, dest_drive, benchmark_size):
     best_speed = 0
     best_block_size = 32768
 
-    for bs in block_sizes:
-        duration, output_file = run_dd(source_drive, dest_drive, bs, benchmark_size)
-        if duration is None:
-            results.append((format_block_size(bs), None, None, None))
-            continue
-        try:
-            time_seconds, speed, bytes_transferred = parse_speed(output_file)
-            mb_transferred = bytes_transferred / (1024 * 1024)
-            gb_transferred = bytes_transferred / (1024**3)
-            speed_value, speed_unit = speed.split()
-            speed_value = float(speed_value)
-            if "GB" in speed_unit:
-                speed_value *= 1024  # Convert GB/s to MB/s
-            results.append(
-                (format_block_size(bs),
-                 f"{mb_transferred:.2f} MB / {gb_transferred:.2f} GB",
-                 time_seconds, speed)
-            )
-            if speed_value > best_speed:
-                best_speed = speed_value
-                best_block_size = bs
-        except (ValueError, IndexError):
+    try:
+        regions = max(1, device_size(dest_drive) // (benchmark_size * 2 * 1024 * 1024))
+    except OSError as e:
+        print(colored(f"Error reading the size of {dest_drive}: {e}", 'red'))
+        return best_block_size
+
+    # Clear once up front; every trial then writes to a fresh region instead.
+    clear_destination(dest_drive)
+
+    for trial_index, bs in enumerate(block_sizes):
+        duration, bytes_transferred = run_dd(source_drive, dest_drive, bs, benchmark_size, trial_index % regions)
+        if not duration or not bytes_transferred:
             results.append((format_block_size(bs), None, None, None))
             continue
-
-    df = pd.DataFrame(results, columns=["Block Size", "Data Transferred", "Time (seconds)", "Speed"])
-    table = tabulate(df, headers='keys', tablefmt='fancy_grid')
+        mb_transferred = bytes_transferred / (1024 * 1024)
+        gb_transferred = bytes_transferred / (1024**3)
+        speed_value = mb_transferred / duration
+        results.append(
+            (format_block_size(bs),
+             f"{mb_transferred:.2f} MB / {gb_transferred:.2f} GB",
+             duration, f"{speed_value:.2f} MB/s")
+        )
+        if speed_value > best_speed:
+            best_speed = speed_value
+            best_block_size = bs
+
+    table = tabulate(results, headers=["Block Size", "Data Transferred", "Time (seconds)", "Speed"],
+                     tablefmt='fancy_grid')
     print(colored(table, 'cyan'))
 
     print(colored(f"Best block size determined: {format_block_size(best_block_size)} with speed: {best_speed:.2f} MB/s", 'green'))
@@ -205,7 +241,7 @@ def execute_with_autobench(source_drive, dest_drive):
 def create_dd_script(source_drive, dest_drive, block_size):
     """Creates the dd script to be run by the systemd service."""
     script_content = f"""#!/bin/bash
-dd if={source_drive} of={dest_drive} bs={block_size} seek=8192 status=progress conv=fsync
+dd if={source_drive} of={dest_drive} bs={block_size} seek=8192 iflag=direct,fullblock oflag=direct status=progress conv=fsync
 """
     with open("/usr/local/bin/run_dd.sh", "w", encoding="utf-8") as f:
         f.write(script_content)
@@ -222,6 +258,11 @@ Type=simple
 ExecStart=/usr/local/bin/run_dd.sh
 Restart=on-failure
 User=root
+Nice=-20
+IOSchedulingClass=realtime
+IOSchedulingPriority=0
+CPUSchedulingPolicy=fifo
+CPUSchedulingPriority=50
 StandardOutput=journal
 StandardError=journal
 